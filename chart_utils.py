@@ -0,0 +1,51 @@
+"""
+Chart Utilities
+
+Shared helpers for the sleep quality chart modules: off-screen rendering,
+figure reuse, time-axis label layout and PNG/base64 encoding of matplotlib figures.
+"""
+
+import matplotlib
+matplotlib.use('Agg')  # render off-screen; no GUI toolkit needed for PNG output
+from matplotlib.axes import Axes
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import numpy as np
+import io
+import binascii
+from PIL import Image
+
+
+def new_figure(figsize, nrows: int = 1, ncols: int = 1, **subplot_kw):
+    """Return (fig, axes) on a private Agg canvas.
+
+    The figure is not registered with pyplot, so it never becomes the caller's
+    current figure and is freed once the last reference to it is dropped.
+    """
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig, fig.subplots(nrows, ncols, **subplot_kw)
+
+
+def reset_layout(fig: Figure) -> None:
+    """Restore default subplot margins so a reused figure lays out like a fresh one."""
+    fig.subplots_adjust(**{k: matplotlib.rcParams[f'figure.subplot.{k}']
+                           for k in ('left', 'right', 'bottom', 'top', 'wspace', 'hspace')})
+
+
+def fig_to_base64(fig: Figure) -> str:
+    """Return a figure as a base64-encoded PNG, leaving it open for reuse."""
+    # render to RGBA and let Pillow encode at zlib level 1 (matplotlib uses 6)
+    fig.canvas.draw()
+    img = Image.fromarray(np.asarray(fig.canvas.buffer_rgba()))
+    buf = io.BytesIO()
+    img.save(buf, format='PNG', compress_level=1)
+    # encode straight from the buffer's memory, no intermediate bytes copy
+    return binascii.b2a_base64(buf.getbuffer(), newline=False).decode('ascii')
+
+
+def rotate_time_labels(ax: Axes) -> None:
+    """Tilt x tick labels by a fixed angle instead of fig.autofmt_xdate()."""
+    for label in ax.get_xticklabels():
+        label.set_rotation(30)
+        label.set_ha('right')
@@ -7,152 +7,298 @@ This module provides functions to generate separate visualizations for one speci
   - SpO2 trend
   - Wrist temperature trend
   - Sleep stage pie chart
+  - All four time-series trends in a single 2x2 panel
 Additionally, it includes a simple 1D-CNN to predict sleep quality score and compute channel importance.
 Each time-based chart now uses consistent x-axis from start_time to end_time with hourly ticks for clear comparison across charts.
 """
 
 import numpy as np
+from chart_utils import fig_to_base64, new_figure, reset_layout, rotate_time_labels
 import matplotlib.pyplot as plt
 import datetime
+import functools
 import matplotlib.dates as mdates
-from typing import Dict
-import io
-import base64
-from keras import layers, models
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
 
+if TYPE_CHECKING:
+    from keras import models
 
-# --- Helper to convert figures to base64 ---
+# shared hourly tick locator/formatter; each chart is rendered before the next
+# one rebinds them to its own axis
+_HOUR_LOCATOR = mdates.HourLocator()
+_HHMM_FORMATTER = mdates.DateFormatter('%H:%M')
 
-def _fig_to_base64(fig: plt.Figure) -> str:
-    buf = io.BytesIO()
-    fig.savefig(buf, format='png', bbox_inches='tight')
-    plt.close(fig)
-    buf.seek(0)
-    return base64.b64encode(buf.read()).decode('utf-8')
+
+# --- Cached figures, reused across charts and keyed by figsize and grid ---
+
+_FIGURES: Dict[Tuple[Tuple[float, float], int, int], Tuple[plt.Figure, Any]] = {}
+
+
+def _get_axes(figsize: Tuple[float, float], nrows: int = 1, ncols: int = 1) -> Any:
+    """Return the cached axes (an array for grids) for a layout, cleared for the next chart."""
+    key = (figsize, nrows, ncols)
+    if key not in _FIGURES:
+        _FIGURES[key] = new_figure(figsize, nrows, ncols, sharex=True)
+    fig, axes = _FIGURES[key]
+    reset_layout(fig)
+    for ax in np.atleast_1d(axes).flat:
+        ax.clear()
+    return axes
+
+
+def close_figures() -> None:
+    """Release all cached figures."""
+    _FIGURES.clear()
+
+
+# --- Helper to build evenly spaced time axis ---
+
+def _naive_utc(dt: datetime.datetime) -> datetime.datetime:
+    """Return dt as a naive UTC datetime; naive input is returned unchanged."""
+    if dt.tzinfo is None:
+        return dt
+    return dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _make_time_axis(start: datetime.datetime, end: datetime.datetime, n: int) -> np.ndarray:
+    """Return n evenly spaced datetime64[us] timestamps from start to end (inclusive).
+
+    Offset-aware endpoints (e.g. Apple Health exports) are converted to UTC,
+    which is also how matplotlib places aware datetimes on the x-axis.
+    """
+    t0 = np.datetime64(_naive_utc(start), 'us')
+    span = (np.datetime64(_naive_utc(end), 'us') - t0).astype(np.int64)
+    # integer microsecond steps: exact endpoints, no float rounding
+    steps = np.arange(n, dtype=np.int64) * span // max(n - 1, 1)
+    return t0 + steps.astype('timedelta64[us]')
+
+
+# --- Helper to thin dense series before plotting ---
+
+def _downsample_minmax(times: np.ndarray, values: np.ndarray,
+                       target: int = 2000) -> Tuple[np.ndarray, np.ndarray]:
+    """Reduce a series to about target points, keeping each bucket's min and max."""
+    n = len(values)
+    if n <= target:
+        return times, values
+    stride = -(-2 * n // target)  # ceil: two points kept per bucket
+    n_buckets = -(-n // stride)
+    # pad the short last bucket with its final value; padded hits clip back to n - 1
+    buckets = np.pad(values, (0, n_buckets * stride - n), mode='edge').reshape(n_buckets, stride)
+    base = np.arange(n_buckets) * stride
+    pairs = np.stack([base + buckets.argmin(axis=1), base + buckets.argmax(axis=1)], axis=1)
+    # keep min/max in time order within each bucket
+    idx = np.minimum(np.sort(pairs, axis=1).ravel(), n - 1)
+    return times[idx], values[idx]
+
+
+# --- Shared time-series chart ---
+
+# sleep_data key -> (title, ylabel, color, ylim)
+_TIMESERIES_SPECS: Dict[str, Tuple[str, str, str, Optional[Tuple[float, float]]]] = {
+    'heart_rate': ('Heart Rate (BPM)', 'BPM', 'tab:red', None),
+    'hrv': ('HRV', 'HRV Metric', 'tab:blue', None),
+    'spo2': ('SpO2 (%)', 'SpO2 (%)', 'tab:green', (80, 100)),
+    'wrist_temp': ('Wrist Temperature (°C)', 'Temperature (°C)', 'tab:orange', None),
+}
+
+
+def _parse_window(sleep_data: Dict) -> Tuple[datetime.datetime, datetime.datetime]:
+    """Return the parsed (start_time, end_time) of a night."""
+    return (datetime.datetime.fromisoformat(sleep_data['start_time']),
+            datetime.datetime.fromisoformat(sleep_data['end_time']))
+
+
+def _load_series(sleep_data: Dict, keys) -> Tuple[datetime.datetime, datetime.datetime,
+                                                  Dict[str, Tuple[np.ndarray, np.ndarray]]]:
+    """Parse a night once and return (start, end, {key: (times, values)}).
+
+    Metrics with the same number of samples share one time axis array.
+    """
+    start, end = _parse_window(sleep_data)
+    time_axes: Dict[int, np.ndarray] = {}
+    series: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+    for key in keys:
+        values = np.asarray(sleep_data[key], dtype=np.float32)
+        if len(values) not in time_axes:
+            time_axes[len(values)] = _make_time_axis(start, end, len(values))
+        series[key] = (time_axes[len(values)], values)
+    return start, end, series
+
+
+def _draw_series(ax: plt.Axes, key: str, times: np.ndarray, values: np.ndarray) -> None:
+    """Plot one metric on ax with its title, label, limits and grid."""
+    title, ylabel, color, ylim = _TIMESERIES_SPECS[key]
+    times, values = _downsample_minmax(times, values)
+    ax.plot(times, values, color=color, linewidth=2)
+    ax.set_title(title)
+    ax.set_ylabel(ylabel)
+    if ylim is not None:
+        ax.set_ylim(*ylim)
+    ax.grid(alpha=0.3)
+
+
+def _plot_timeseries(key: str, times: np.ndarray, values: np.ndarray,
+                     start: datetime.datetime, end: datetime.datetime) -> str:
+    """Return a base64 PNG of one metric over time with hourly x-axis ticks."""
+    ax = _get_axes((10, 4))
+    fig = ax.figure
+    _draw_series(ax, key, times, values)
+    ax.set_xlabel('Time')
+    ax.set_xlim(start, end)
+    ax.xaxis.set_major_locator(_HOUR_LOCATOR)
+    ax.xaxis.set_major_formatter(_HHMM_FORMATTER)
+    fig.subplots_adjust(left=0.08, right=0.97, top=0.9, bottom=0.2)
+    rotate_time_labels(ax)
+    return fig_to_base64(fig)
+
+
+def _generate_timeseries_chart(sleep_data: Dict, key: str) -> str:
+    """Parse one metric from sleep_data and plot it."""
+    start, end, series = _load_series(sleep_data, (key,))
+    return _plot_timeseries(key, *series[key], start, end)
 
 
 # --- Individual Charts for Single Night ---
 
 def generate_hr_chart(sleep_data: Dict) -> str:
     """Return a base64 PNG of heart rate over time with hourly x-axis ticks."""
-    start = datetime.datetime.fromisoformat(sleep_data['start_time'])
-    end = datetime.datetime.fromisoformat(sleep_data['end_time'])
-    hr = np.array(sleep_data['heart_rate'], dtype=float)
-    n = len(hr)
-    times = [start + (end - start) * i/(n-1) for i in range(n)]
-
-    fig, ax = plt.subplots(figsize=(10,4))
-    ax.plot(times, hr, color='tab:red', linewidth=2)
-    ax.set_title('Heart Rate (BPM)')
-    ax.set_xlabel('Time')
-    ax.set_ylabel('BPM')
-    ax.set_xlim(start, end)
-    ax.xaxis.set_major_locator(mdates.HourLocator())
-    ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-    ax.grid(alpha=0.3)
-    fig.autofmt_xdate()
-    return _fig_to_base64(fig)
+    return _generate_timeseries_chart(sleep_data, 'heart_rate')
 
 
 def generate_hrv_chart(sleep_data: Dict) -> str:
     """Return a base64 PNG of HRV over time with hourly x-axis ticks."""
-    start = datetime.datetime.fromisoformat(sleep_data['start_time'])
-    end = datetime.datetime.fromisoformat(sleep_data['end_time'])
-    hrv = np.array(sleep_data['hrv'], dtype=float)
-    n = len(hrv)
-    times = [start + (end - start) * i/(n-1) for i in range(n)]
-
-    fig, ax = plt.subplots(figsize=(10,4))
-    ax.plot(times, hrv, color='tab:blue', linewidth=2)
-    ax.set_title('HRV')
-    ax.set_xlabel('Time')
-    ax.set_ylabel('HRV Metric')
-    ax.set_xlim(start, end)
-    ax.xaxis.set_major_locator(mdates.HourLocator())
-    ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-    ax.grid(alpha=0.3)
-    fig.autofmt_xdate()
-    return _fig_to_base64(fig)
+    return _generate_timeseries_chart(sleep_data, 'hrv')
 
 
 def generate_spo2_chart(sleep_data: Dict) -> str:
     """Return a base64 PNG of SpO2 over time with hourly x-axis ticks."""
-    start = datetime.datetime.fromisoformat(sleep_data['start_time'])
-    end = datetime.datetime.fromisoformat(sleep_data['end_time'])
-    spo2 = np.array(sleep_data['spo2'], dtype=float)
-    n = len(spo2)
-    times = [start + (end - start) * i/(n-1) for i in range(n)]
-
-    fig, ax = plt.subplots(figsize=(10,4))
-    ax.plot(times, spo2, color='tab:green', linewidth=2)
-    ax.set_title('SpO2 (%)')
-    ax.set_xlabel('Time')
-    ax.set_ylabel('SpO2 (%)')
-    ax.set_xlim(start, end)
-    ax.xaxis.set_major_locator(mdates.HourLocator())
-    ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-    ax.set_ylim(80,100)
-    ax.grid(alpha=0.3)
-    fig.autofmt_xdate()
-    return _fig_to_base64(fig)
+    return _generate_timeseries_chart(sleep_data, 'spo2')
 
 
 def generate_temp_chart(sleep_data: Dict) -> str:
     """Return a base64 PNG of wrist temperature over time with hourly x-axis ticks."""
-    start = datetime.datetime.fromisoformat(sleep_data['start_time'])
-    end = datetime.datetime.fromisoformat(sleep_data['end_time'])
-    temp = np.array(sleep_data['wrist_temp'], dtype=float)
-    n = len(temp)
-    times = [start + (end - start) * i/(n-1) for i in range(n)]
-
-    fig, ax = plt.subplots(figsize=(10,4))
-    ax.plot(times, temp, color='tab:orange', linewidth=2)
-    ax.set_title('Wrist Temperature (°C)')
-    ax.set_xlabel('Time')
-    ax.set_ylabel('Temperature (°C)')
-    ax.set_xlim(start, end)
-    ax.xaxis.set_major_locator(mdates.HourLocator())
-    ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-    ax.grid(alpha=0.3)
-    fig.autofmt_xdate()
-    return _fig_to_base64(fig)
+    return _generate_timeseries_chart(sleep_data, 'wrist_temp')
 
 
 def generate_sleep_stage_pie_chart(sleep_data: Dict) -> str:
     """Return a base64 PNG pie chart of sleep stage durations."""
     stages = sleep_data['sleep_stages']
-    labels = []
-    sizes = []
-    total = sum(stages.values())
-    for stage in ['deep','rem','light','awake']:
-        dur = stages.get(stage,0)
-        labels.append(f"{stage.title()}: {dur}m ({dur/total*100:.1f}%)")
-        sizes.append(dur)
-    fig, ax = plt.subplots(figsize=(6,6))
+    keys = ('deep','rem','light','awake')
+    sizes = np.array([stages.get(k,0) for k in keys], dtype=np.float32)
+    pcts = sizes * (100.0 / sum(stages.values()))
+    labels = [f"{k.title()}: {d:.0f}m ({p:.1f}%)" for k, d, p in zip(keys, sizes, pcts)]
+    ax = _get_axes((6, 6))
     colors = ['navy','purple','skyblue','lightgray']
     ax.pie(sizes, labels=labels, colors=colors, startangle=90)
     ax.set_title(f"Sleep Stages Breakdown - {sleep_data.get('date','')}")
-    return _fig_to_base64(fig)
+    # wedge labels vary in length, so size the margins from their extents
+    ax.figure.tight_layout()
+    return fig_to_base64(ax.figure)
+
+
+def generate_all_charts(sleep_data: Dict) -> Dict[str, str]:
+    """Return base64 PNGs for every chart of one night, keyed by sleep_data field.
+
+    Parses start/end once and shares one time axis between metrics of equal
+    length; prefer this over the individual generate_* functions when all
+    charts are needed.
+    """
+    start, end, series = _load_series(sleep_data, _TIMESERIES_SPECS)
+    charts: Dict[str, str] = {key: _plot_timeseries(key, times, values, start, end)
+                              for key, (times, values) in series.items()}
+    charts['sleep_stages'] = generate_sleep_stage_pie_chart(sleep_data)
+    return charts
+
+
+def generate_vitals_panel(sleep_data: Dict) -> str:
+    """Return one base64 PNG with all four time-series metrics in a 2x2 grid.
+
+    The panels share the hourly x-axis and are drawn and encoded in a single
+    pass, which is cheaper than four separate charts.
+    """
+    start, end, series = _load_series(sleep_data, _TIMESERIES_SPECS)
+    axes = _get_axes((14, 8), nrows=2, ncols=2)
+    fig = axes.flat[0].figure
+    for ax, (key, (times, values)) in zip(axes.flat, series.items()):
+        _draw_series(ax, key, times, values)
+    # x-axis ticker is shared, so configuring one panel configures all
+    ax = axes.flat[0]
+    ax.set_xlim(start, end)
+    ax.xaxis.set_major_locator(_HOUR_LOCATOR)
+    ax.xaxis.set_major_formatter(_HHMM_FORMATTER)
+    fig.subplots_adjust(left=0.06, right=0.98, top=0.94, bottom=0.12, hspace=0.3, wspace=0.2)
+    for ax in axes[-1]:
+        rotate_time_labels(ax)
+    return fig_to_base64(fig)
 
 # --- CNN Model and Importance ---
 
-def build_sleep_cnn(input_length: int, channels: int = 4) -> models.Model:
-    """Build and compile a 1D-CNN for sleep score prediction."""
+def get_fresh_sleep_cnn(input_length: int, channels: int = 4) -> "models.Model":
+    """Build and compile a new 1D-CNN for sleep score prediction."""
+    # imported lazily so chart-only workflows never pay for TensorFlow init
+    from keras import layers, models
+
+    # input is (time, channel); pin channels_last so no backend reorders it
+    fmt = 'channels_last'
     inp = layers.Input(shape=(input_length, channels), name='sleep_input')
-    x = layers.Conv1D(32, kernel_size=5, activation='relu', padding='same')(inp)
-    x = layers.MaxPooling1D(pool_size=2)(x)
-    x = layers.Conv1D(64, kernel_size=5, activation='relu', padding='same')(x)
-    x = layers.GlobalAveragePooling1D()(x)
+    x = layers.Conv1D(32, kernel_size=5, activation='relu', padding='same', data_format=fmt)(inp)
+    x = layers.MaxPooling1D(pool_size=2, data_format=fmt)(x)
+    x = layers.Conv1D(64, kernel_size=5, activation='relu', padding='same', data_format=fmt)(x)
+    x = layers.GlobalAveragePooling1D(data_format=fmt)(x)
     out = layers.Dense(1, activation='linear', name='score_output')(x)
     model = models.Model(inputs=inp, outputs=out, name='SleepQualityCNN')
-    model.compile(optimizer='adam', loss='mse', metrics=['mae'])
+    # XLA-fuse the conv -> pool -> conv -> pool -> dense chain
+    model.compile(optimizer='adam', loss='mse', metrics=['mae'], jit_compile=True)
     return model
 
 
-def compute_channel_importance(cnn_model: models.Model) -> Dict[str, float]:
-    """Return normalized sum of abs weights of first Conv1D per channel."""
-    w = cnn_model.layers[1].get_weights()[0]
-    abs_sum = np.sum(np.abs(w), axis=(0,2))
+@functools.lru_cache(maxsize=8)
+def _cached_sleep_cnn(input_length: int, channels: int) -> "models.Model":
+    return get_fresh_sleep_cnn(input_length, channels)
+
+
+def build_sleep_cnn(input_length: int, channels: int = 4) -> "models.Model":
+    """Return a compiled 1D-CNN for sleep score prediction, cached per shape.
+
+    The same model instance is shared by every caller with the same
+    (input_length, channels); use get_fresh_sleep_cnn() when training.
+    Clear with build_sleep_cnn.cache_clear().
+    """
+    # positional call so every spelling of the same shape hits one cache entry
+    return _cached_sleep_cnn(input_length, channels)
+
+
+build_sleep_cnn.cache_clear = _cached_sleep_cnn.cache_clear
+
+
+def quantize_sleep_cnn(model: "models.Model", repr_data: np.ndarray) -> bytes:
+    """Convert a trained sleep CNN to an int8 TFLite flatbuffer.
+
+    repr_data is a (samples, input_length, channels) array used to calibrate
+    activation ranges; at most the first 100 samples are used. Run the result
+    with tf.lite.Interpreter(model_content=...).
+    """
+    import tensorflow as tf
+
+    def representative_dataset():
+        for x in repr_data[:100]:
+            yield [np.asarray(x, dtype=np.float32)[np.newaxis, ...]]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
+
+
+def compute_channel_importance(weights: np.ndarray) -> Dict[str, float]:
+    """Return normalized sum of abs weights per channel from a Conv1D kernel.
+
+    weights is the raw (kernel_size, channels, filters) kernel, e.g.
+    model.layers[1].get_weights()[0] for the first Conv1D of build_sleep_cnn.
+    """
+    abs_sum = np.sum(np.abs(weights), axis=(0,2))
     norms = abs_sum / np.sum(abs_sum)
     names = ['heart_rate','hrv','spo2','wrist_temp']
     return {names[i]: float(norms[i]) for i in range(len(names))}
\ No newline at end of file
@@ -5,13 +5,12 @@ This module provides visualization functions for the sleep quality assessment sy
 including graphic displays of individual metrics, overall score, and trend analysis.
 """
 
+from chart_utils import fig_to_base64, new_figure, reset_layout, rotate_time_labels
 import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 import datetime
-from typing import Dict, List
-import io
-import base64
+from typing import Dict, List, Tuple
 
 class SleepQualityVisualizer:
     """
@@ -27,6 +26,8 @@ class SleepQualityVisualizer:
         """
         self.theme = theme
         self._set_style()
+        # cached (figure, axes) pairs keyed by figsize, reused across charts
+        self._figures: Dict[Tuple[float, float], Tuple[plt.Figure, plt.Axes]] = {}
 
     def _set_style(self) -> None:
         """Set the visual style based on the theme."""
@@ -57,18 +58,35 @@ class SleepQualityVisualizer:
                 'background': '#ffffff'
             }
 
-    def _figure_to_base64(self) -> str:
+    def _get_axes(self, figsize: Tuple[float, float]) -> plt.Axes:
         """
-        Convert the current matplotlib figure to a base64-encoded PNG and close it.
+        Return the cached axes for a figure size, cleared for the next chart.
+        Args:
+            figsize: Figure size in inches
+        Returns:
+            Matplotlib Axes
+        """
+        if figsize not in self._figures:
+            self._figures[figsize] = new_figure(figsize)
+        fig, ax = self._figures[figsize]
+        reset_layout(fig)
+        ax.clear()
+        ax.set_axis_on()
+        return ax
+
+    def close(self) -> None:
+        """Release all cached figures."""
+        self._figures.clear()
+
+    def _figure_to_base64(self, fig: plt.Figure) -> str:
+        """
+        Convert a matplotlib figure to a base64-encoded PNG, keeping it open for reuse.
+        Args:
+            fig: Figure to encode
         Returns:
             Base64 string
         """
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', bbox_inches='tight', facecolor=plt.gcf().get_facecolor())
-        plt.close()
-        buf.seek(0)
-        img_bytes = buf.read()
-        return base64.b64encode(img_bytes).decode('utf-8')
+        return fig_to_base64(fig)
 
     def generate_score_card(self, score: int) -> str:
         """
@@ -78,12 +96,12 @@ class SleepQualityVisualizer:
         Returns:
             Base64 encoded PNG image
         """
-        plt.figure(figsize=(4, 4))
-        plt.text(0.5, 0.5, f"{score}", fontsize=72, ha='center', va='center', color=self.colors['primary'])
-        plt.text(0.5, 0.3, "Sleep Score", fontsize=14, ha='center', va='center', color=self.colors['text'])
-        plt.axis('off')
-        plt.tight_layout()
-        return self._figure_to_base64()
+        ax = self._get_axes((4, 4))
+        ax.text(0.5, 0.5, f"{score}", fontsize=72, ha='center', va='center', color=self.colors['primary'])
+        ax.text(0.5, 0.3, "Sleep Score", fontsize=14, ha='center', va='center', color=self.colors['text'])
+        ax.axis('off')
+        ax.figure.tight_layout()
+        return self._figure_to_base64(ax.figure)
 
     def generate_sleep_quality_trend(self, data: List[Dict], days: int = 14) -> str:
         """
@@ -97,36 +115,35 @@ class SleepQualityVisualizer:
         """
         if not data:
             return ""
-        df = pd.DataFrame([
-            {'date': datetime.datetime.fromisoformat(item['date']),
-             'score': item['sleep_quality_score']}
-            for item in data
-        ])
-        df = df.sort_values('date')
-        if len(df) > days:
-            df = df.iloc[-days:]
-
-        plt.figure(figsize=(10, 5))
-        plt.plot(df['date'], df['score'], 'o-', color=self.colors['primary'], linewidth=2)
-        # trend line
-        z = np.polyfit(range(len(df)), df['score'], 1)
-        p = np.poly1d(z)
-        plt.plot(df['date'], p(range(len(df))), '--', color=self.colors['secondary'], linewidth=1.5, alpha=0.8)
+        dates = np.array([np.datetime64(item['date']) for item in data])
+        scores = np.array([item['sleep_quality_score'] for item in data], dtype=np.float32)
+        order = np.argsort(dates, kind='stable')
+        dates, scores = dates[order][-days:], scores[order][-days:]
+
+        ax = self._get_axes((10, 5))
+        ax.plot(dates, scores, 'o-', color=self.colors['primary'], linewidth=2)
+        # trend line (closed-form least squares)
+        x = np.arange(len(scores), dtype=np.float64)
+        y = scores.astype(np.float64)
+        denom = x.size * np.dot(x, x) - x.sum() ** 2
+        m = (x.size * np.dot(x, y) - x.sum() * y.sum()) / denom if denom else 0.0
+        b = (y.sum() - m * x.sum()) / x.size
+        ax.plot(dates, m * x + b, '--', color=self.colors['secondary'], linewidth=1.5, alpha=0.8)
 
         # annotate latest score
-        latest_date = df['date'].iloc[-1]
-        latest_score = df['score'].iloc[-1]
-        plt.scatter([latest_date], [latest_score], color=self.colors['accent'], s=100)
-        plt.text(latest_date, latest_score + 2, f"{int(latest_score)}", fontsize=12,
+        latest_date = dates[-1]
+        latest_score = scores[-1]
+        ax.scatter([latest_date], [latest_score], color=self.colors['accent'], s=100)
+        ax.text(latest_date, latest_score + 2, f"{int(latest_score)}", fontsize=12,
                  ha='center', va='bottom', color=self.colors['text'])
 
-        plt.title('Sleep Quality Score Trend', fontsize=16)
-        plt.ylabel('Sleep Quality Score', fontsize=12)
-        plt.ylim(0, 100)
-        plt.grid(True, alpha=0.3)
-        plt.gcf().autofmt_xdate()
-        plt.tight_layout()
-        return self._figure_to_base64()
+        ax.set_title('Sleep Quality Score Trend', fontsize=16)
+        ax.set_ylabel('Sleep Quality Score', fontsize=12)
+        ax.set_ylim(0, 100)
+        ax.grid(True, alpha=0.3)
+        rotate_time_labels(ax)
+        ax.figure.tight_layout()
+        return self._figure_to_base64(ax.figure)
 
     def generate_sleep_structure_chart(self, sleep_data: Dict) -> str:
         """
@@ -137,21 +154,18 @@ class SleepQualityVisualizer:
             Base64 encoded PNG image
         """
         stages = sleep_data['sleep_stages']
-        total = sum(stages.values())
-        plt.figure(figsize=(8, 6))
-        colors = [self.colors['deep'], self.colors['rem'], self.colors['light'], self.colors['awake']]
-        labels = [
-            f"Deep: {stages['deep']:.0f}m ({stages['deep']/total*100:.1f}%)",
-            f"REM: {stages['rem']:.0f}m ({stages['rem']/total*100:.1f}%)",
-            f"Light: {stages['light']:.0f}m ({stages['light']/total*100:.1f}%)",
-            f"Awake: {stages['awake']:.0f}m ({stages['awake']/total*100:.1f}%)"
-        ]
-        plt.pie([stages['deep'], stages['rem'], stages['light'], stages['awake']],
-                labels=labels, colors=colors, autopct='', startangle=90, wedgeprops={'alpha':0.8})
+        keys = ('deep', 'rem', 'light', 'awake')
+        durations = np.array([stages[k] for k in keys], dtype=np.float32)
+        pcts = durations * (100.0 / sum(stages.values()))
+        ax = self._get_axes((8, 6))
+        colors = [self.colors[k] for k in keys]
+        labels = [f"{name}: {d:.0f}m ({p:.1f}%)"
+                  for name, d, p in zip(('Deep', 'REM', 'Light', 'Awake'), durations, pcts)]
+        ax.pie(durations, labels=labels, colors=colors, startangle=90, wedgeprops={'alpha':0.8})
         date_str = sleep_data.get('date', '')
-        plt.title(f"Sleep Structure - {date_str}", fontsize=16)
-        plt.tight_layout()
-        return self._figure_to_base64()
+        ax.set_title(f"Sleep Structure - {date_str}", fontsize=16)
+        ax.figure.tight_layout()
+        return self._figure_to_base64(ax.figure)
 
     def generate_heart_rate_chart(self, sleep_data: Dict) -> str:
         """
@@ -161,23 +175,26 @@ class SleepQualityVisualizer:
         Returns:
             Base64 encoded PNG image
         """
-        hr = sleep_data['heart_rate']
+        hr = np.asarray(sleep_data['heart_rate'], dtype=np.float32)
         start = datetime.datetime.fromisoformat(sleep_data['start_time'])
         end   = datetime.datetime.fromisoformat(sleep_data['end_time'])
         duration = (end - start).total_seconds() / 3600
         times = [start + datetime.timedelta(hours=duration * i / len(hr)) for i in range(len(hr))]
-        plt.figure(figsize=(10,5))
-        plt.plot(times, hr, '-', color=self.colors['primary'], linewidth=2, alpha=0.8)
+        ax = self._get_axes((10, 5))
+        ax.plot(times, hr, '-', color=self.colors['primary'], linewidth=2, alpha=0.8)
         window = max(5, len(hr)//20)
         if len(hr) > window:
-            sr = pd.Series(hr).rolling(window=window, center=True).mean()
-            plt.plot(times, sr, '-', color=self.colors['accent'], linewidth=2.5)
-        plt.title('Heart Rate During Sleep', fontsize=16)
-        plt.ylabel('BPM', fontsize=12)
-        plt.grid(alpha=0.3)
-        plt.gcf().autofmt_xdate()
-        plt.tight_layout()
-        return self._figure_to_base64()
+            # centered moving average; 'valid' mode skips the partial windows at the edges
+            kernel = np.ones(window, dtype=np.float64) / window
+            sr = np.convolve(np.asarray(hr, dtype=np.float64), kernel, mode='valid')
+            offset = window // 2
+            ax.plot(times[offset:offset + len(sr)], sr, '-', color=self.colors['accent'], linewidth=2.5)
+        ax.set_title('Heart Rate During Sleep', fontsize=16)
+        ax.set_ylabel('BPM', fontsize=12)
+        ax.grid(alpha=0.3)
+        rotate_time_labels(ax)
+        ax.figure.tight_layout()
+        return self._figure_to_base64(ax.figure)
 
     def generate_hrv_trend(self, sleep_data: Dict) -> str:
         """
@@ -187,45 +204,45 @@ class SleepQualityVisualizer:
         Returns:
             Base64 encoded PNG image
         """
-        hrv = np.array(sleep_data['hrv'], dtype=float)
+        hrv = np.asarray(sleep_data['hrv'], dtype=np.float32)
         start = datetime.datetime.fromisoformat(sleep_data['start_time'])
         end   = datetime.datetime.fromisoformat(sleep_data['end_time'])
         # compute frequency string safely
         total_secs = (end - start).total_seconds()
         freq_secs = int(total_secs / len(hrv)) if len(hrv) > 0 else 1
         times = pd.date_range(start=start, periods=len(hrv), freq=f"{freq_secs}S")
-        plt.figure(figsize=(10,4))
-        plt.plot(times, hrv, '-', linewidth=2, color=self.colors['deep'])
-        plt.title('HRV During Sleep', fontsize=16)
-        plt.ylabel('HRV Metric', fontsize=12)
-        plt.grid(alpha=0.3)
-        plt.gcf().autofmt_xdate()
-        plt.tight_layout()
-        return self._figure_to_base64()
+        ax = self._get_axes((10, 4))
+        ax.plot(times, hrv, '-', linewidth=2, color=self.colors['deep'])
+        ax.set_title('HRV During Sleep', fontsize=16)
+        ax.set_ylabel('HRV Metric', fontsize=12)
+        ax.grid(alpha=0.3)
+        rotate_time_labels(ax)
+        ax.figure.tight_layout()
+        return self._figure_to_base64(ax.figure)
 
     def generate_spo2_trend(self, sleep_data: Dict) -> str:
         """
         Generate a chart showing blood oxygen (SpO2) trend during sleep.
         """
-        spo2 = np.array(sleep_data['spo2'], dtype=float)
-        plt.figure(figsize=(10,4))
-        plt.plot(spo2, '-', linewidth=2, color=self.colors['rem'])
-        plt.title('SpO2 During Sleep', fontsize=16)
-        plt.ylabel('SpO2 (%)', fontsize=12)
-        plt.ylim(80, 100)
-        plt.grid(alpha=0.3)
-        plt.tight_layout()
-        return self._figure_to_base64()
+        spo2 = np.asarray(sleep_data['spo2'], dtype=np.float32)
+        ax = self._get_axes((10, 4))
+        ax.plot(spo2, '-', linewidth=2, color=self.colors['rem'])
+        ax.set_title('SpO2 During Sleep', fontsize=16)
+        ax.set_ylabel('SpO2 (%)', fontsize=12)
+        ax.set_ylim(80, 100)
+        ax.grid(alpha=0.3)
+        ax.figure.tight_layout()
+        return self._figure_to_base64(ax.figure)
 
     def generate_temperature_trend(self, sleep_data: Dict) -> str:
         """
         Generate a chart showing wrist temperature trend during sleep.
         """
-        temp = np.array(sleep_data['wrist_temp'], dtype=float)
-        plt.figure(figsize=(10,4))
-        plt.plot(temp, '-', linewidth=2, color=self.colors['light'])
-        plt.title('Wrist Temperature During Sleep', fontsize=16)
-        plt.ylabel('Temperature (°C)', fontsize=12)
-        plt.grid(alpha=0.3)
-        plt.tight_layout()
-        return self._figure_to_base64()
+        temp = np.asarray(sleep_data['wrist_temp'], dtype=np.float32)
+        ax = self._get_axes((10, 4))
+        ax.plot(temp, '-', linewidth=2, color=self.colors['light'])
+        ax.set_title('Wrist Temperature During Sleep', fontsize=16)
+        ax.set_ylabel('Temperature (°C)', fontsize=12)
+        ax.grid(alpha=0.3)
+        ax.figure.tight_layout()
+        return self._figure_to_base64(ax.figure)
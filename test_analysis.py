@@ -1,14 +1,18 @@
 # test_analysis.py
 
 import base64
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
+import pytest
 from sleep_quality_analysis import (
+    _downsample_minmax,
+    generate_all_charts,
     generate_hr_chart,
-    generate_hrv_chart,
-    generate_spo2_chart,
-    generate_temp_chart,
+    generate_vitals_panel,
     generate_sleep_stage_pie_chart,
     build_sleep_cnn,
+    get_fresh_sleep_cnn,
+    quantize_sleep_cnn,
     compute_channel_importance
 )
 
@@ -35,25 +39,72 @@ sleep_data = {
 # Example final score
 score = 85
 
-# ─── Generate & Save Individual Charts ─────────────────────────────────────────
-save_png(generate_hr_chart(sleep_data),                "hr.png")
-save_png(generate_hrv_chart(sleep_data),               "hrv.png")
-save_png(generate_spo2_chart(sleep_data),              "spo2.png")
-save_png(generate_temp_chart(sleep_data),              "temp.png")
-save_png(generate_sleep_stage_pie_chart(sleep_data),   "stages.png")
+# ─── Generate & Save Charts (one process per chart) ───────────────────────────
+chart_jobs = [
+    (generate_vitals_panel,          "vitals.png"),
+    (generate_sleep_stage_pie_chart, "stages.png"),
+]
 
-print("✓ Charts generated: hr.png, hrv.png, spo2.png, temp.png, stages.png")
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
 
-# ─── Build & Train Demo CNN Model ──────────────────────────────────────────────
-model = build_sleep_cnn(input_length=n, channels=4)
-model.summary()
+def test_vitals_panel_is_png():
+    assert base64.b64decode(generate_vitals_panel(sleep_data)).startswith(PNG_SIGNATURE)
 
-# Fake training data for demonstration
-X = np.random.randn(10, n, 4).astype(np.float32)
-y = np.random.randint(50, 100, size=(10, 1)).astype(np.float32)
+def test_sleep_stage_pie_chart_is_png():
+    assert base64.b64decode(generate_sleep_stage_pie_chart(sleep_data)).startswith(PNG_SIGNATURE)
 
-model.fit(X, y, epochs=2, batch_size=2, verbose=1)
+def test_channel_importance_sums_to_one():
+    w = np.random.randn(5, 4, 32)
+    importances = compute_channel_importance(w)
+    assert list(importances) == ["heart_rate", "hrv", "spo2", "wrist_temp"]
+    assert abs(sum(importances.values()) - 1.0) < 1e-9
 
-# Compute and display channel importances
-importances = compute_channel_importance(model)
-print("Channel importances:", importances)
+def test_build_sleep_cnn_caches_per_shape():
+    pytest.importorskip("keras")
+    build_sleep_cnn.cache_clear()
+    model = build_sleep_cnn(64)
+    assert model is build_sleep_cnn(input_length=64, channels=4)
+    build_sleep_cnn.cache_clear()
+    assert build_sleep_cnn(64) is not model
+
+def test_downsample_minmax_keeps_extremes():
+    dense = 28800  # 8 hours at 1 Hz
+    t = np.arange(dense).astype("datetime64[s]")
+    v = np.full(dense, 60.0, dtype=np.float32)
+    v[12345], v[20000] = 150.0, 30.0
+    for target in (2000, 10):
+        ts, vs = _downsample_minmax(t, v, target=target)
+        assert len(vs) <= target
+        assert np.all(np.diff(ts.astype(np.int64)) >= 0)
+        assert vs.max() == 150.0 and vs.min() == 30.0
+
+def test_generate_all_charts_matches_individual_charts():
+    charts = generate_all_charts(sleep_data)
+    assert set(charts) == {"heart_rate", "hrv", "spo2", "wrist_temp", "sleep_stages"}
+    assert charts["heart_rate"] == generate_hr_chart(sleep_data)
+
+if __name__ == "__main__":
+    with ProcessPoolExecutor(max_workers=4) as ex:
+        futs = {ex.submit(fn, sleep_data): fname for fn, fname in chart_jobs}
+        for fut in as_completed(futs):
+            save_png(fut.result(), futs[fut])
+
+    print("✓ Charts generated: vitals.png, stages.png")
+
+    # ─── Build & Train Demo CNN Model ──────────────────────────────────────────
+    model = get_fresh_sleep_cnn(input_length=n, channels=4)
+    model.summary()
+
+    # Fake training data for demonstration
+    X = np.random.randn(10, n, 4).astype(np.float32)
+    y = np.random.randint(50, 100, size=(10, 1)).astype(np.float32)
+
+    model.fit(X, y, epochs=2, batch_size=2, verbose=1)
+
+    # Compute and display channel importances
+    importances = compute_channel_importance(model.layers[1].get_weights()[0])
+    print("Channel importances:", importances)
+
+    # Quantize the trained model to int8 TFLite for on-device inference
+    tflite_model = quantize_sleep_cnn(model, X)
+    print(f"Quantized TFLite model: {len(tflite_model)} bytes")
@@ -1,6 +1,7 @@
 # test_viz.py
 
 import base64
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 from sleepqualityvisualization import SleepQualityVisualizer
 
@@ -33,33 +34,53 @@ trend_data = [
 
 sleep_score = 83  # example final score
 
-# ─── Generate & Save Charts ────────────────────────────────────────────────────
-
-viz = SleepQualityVisualizer(theme="light")
+# ─── Generate & Save Charts (one process per batch) ───────────────────────────
 
 def save_png(b64_str: str, fname: str):
     with open(fname, "wb") as f:
         f.write(base64.b64decode(b64_str))
 
-# 1) Score card
-save_png(viz.generate_score_card(sleep_score), "score_card.png")
-
-# 2) Trend over days
-save_png(viz.generate_sleep_quality_trend(trend_data), "trend.png")
+def render_batch(jobs):
+    # each worker builds its own visualizer; charts of the same size share its cached figure
+    viz = SleepQualityVisualizer(theme="light")
+    try:
+        return [(fname, getattr(viz, method)(arg)) for method, arg, fname in jobs]
+    finally:
+        viz.close()
+
+# batched by figure size so each worker reuses one figure across its charts
+chart_batches = [
+    [("generate_score_card",            sleep_score, "score_card.png")],   # 1) Score card
+    [("generate_sleep_quality_trend",   trend_data,  "trend.png"),         # 2) Trend over days
+     ("generate_heart_rate_chart",      sleep_data,  "heart_rate.png")],   # 4) Heart rate
+    [("generate_sleep_structure_chart", sleep_data,  "structure.png")],    # 3) Sleep structure pie
+    [("generate_hrv_trend",             sleep_data,  "hrv.png"),           # 5) HRV
+     ("generate_spo2_trend",            sleep_data,  "spo2.png"),          # 6) SpO₂
+     ("generate_temperature_trend",     sleep_data,  "temperature.png")],  # 7) Temperature
+]
 
-# 3) Sleep structure pie
-save_png(viz.generate_sleep_structure_chart(sleep_data), "structure.png")
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
 
-# 4) Heart rate
-save_png(viz.generate_heart_rate_chart(sleep_data), "heart_rate.png")
+def test_heart_rate_chart_is_png():
+    viz = SleepQualityVisualizer(theme="light")
+    assert base64.b64decode(viz.generate_heart_rate_chart(sleep_data)).startswith(PNG_SIGNATURE)
 
-# 5) HRV
-save_png(viz.generate_hrv_trend(sleep_data), "hrv.png")
+def test_sleep_quality_trend_is_png():
+    viz = SleepQualityVisualizer(theme="light")
+    assert base64.b64decode(viz.generate_sleep_quality_trend(trend_data)).startswith(PNG_SIGNATURE)
 
-# 6) SpO₂
-save_png(viz.generate_spo2_trend(sleep_data), "spo2.png")
+def test_reused_figure_matches_fresh_render():
+    viz = SleepQualityVisualizer(theme="light")
+    viz.generate_hrv_trend(sleep_data)
+    reused = viz.generate_spo2_trend(sleep_data)
+    viz.close()
+    assert reused == viz.generate_spo2_trend(sleep_data)
 
-# 7) Temperature
-save_png(viz.generate_temperature_trend(sleep_data), "temperature.png")
+if __name__ == "__main__":
+    with ProcessPoolExecutor(max_workers=4) as ex:
+        futs = [ex.submit(render_batch, batch) for batch in chart_batches]
+        for fut in as_completed(futs):
+            for fname, b64_str in fut.result():
+                save_png(b64_str, fname)
 
-print("✓ All 7 charts written to current folder.")
+    print("✓ All 7 charts written to current folder.")